@@ -162,6 +162,67 @@ class JupyterTest(unittest.TestCase):
 
         self.assertEqual(out_data, expected_output)
         
+
+    def test_remove_cloud_nodata(self):
+        
+        from utilities.util import remove_cloud_nodata
+        
+        blue_data = xr.DataArray([[[ 580.,  723.],
+                                   [ 627.,  691.]],
+                                  
+                                  [[ 597.,  615.],
+                                   [ 562.,  615.]]],
+                                 coords = {'time': ['2018-02-26', 
+                                                    '2018-03-14']}, 
+                                 dims=('time', 'x', 'y'))
+        
+        qa_data = xr.DataArray(np.array([[[322, 324],
+                                          [322,   1]],
+                                         
+                                         [[324, 352],
+                                          [386, 324]]], dtype=np.uint16),
+                               coords = {'time': ['2018-02-26', 
+                                                  '2018-03-14']}, 
+                               dims=('time', 'x', 'y'),
+                               attrs={'nodata': 1})
+        
+        input_data = xr.Dataset({'blue': blue_data, 'pixel_qa': qa_data})
+        
+        expected_blue = np.array([[[ 580., np.nan],
+                                   [ 627., np.nan]]])
+        
+        out_data = remove_cloud_nodata('ls8_usgs_l2c1', input_data, 
+                                       'pixel_qa')
+        
+        self.assertEqual(list(out_data.time.values), ['2018-02-26'])
+        np.testing.assert_array_equal(out_data.blue.values, expected_blue)
+        
+
+    def test_get_stats_per_time(self):
+        
+        from utilities.util import get_stats_per_time
+        
+        blue_data = xr.DataArray([[[ 580.,  720.],
+                                   [ np.nan, 700.]],
+                                  
+                                  [[ 600.,  600.],
+                                   [ 600.,  600.]]],
+                                 coords = {'time': ['2018-02-26', 
+                                                    '2018-03-14']}, 
+                                 dims=('time', 'x', 'y'))
+        
+        mean_sr, min_sr, max_sr, std_sr, variance_sr, valid_pixel_per = \
+            get_stats_per_time(blue_data)
+        
+        np.testing.assert_allclose(mean_sr, [ 2000. / 3, 600.])
+        np.testing.assert_array_equal(min_sr, [ 580., 600.])
+        np.testing.assert_array_equal(max_sr, [ 720., 600.])
+        np.testing.assert_allclose(std_sr, 
+                                   [np.nanstd(blue_data[0].values), 0.])
+        np.testing.assert_allclose(variance_sr, 
+                                   [np.nanvar(blue_data[0].values), 0.])
+        np.testing.assert_array_equal(valid_pixel_per, [ 75., 100.])
+        
            
 #suite = unittest.TestLoader().loadTestsFromTestCase(JupyterTest)
 #unittest.TextTestRunner(verbosity=1, stream=sys.stdout).run(suite)
@@ -125,10 +125,38 @@ def remove_cloud_nodata(source_prod, data, mask_band):
                 nodata_cloud_value = non_ls8_USGS_cloud_pixel_qa_value
                 
         nodata_cloud_value.append(nodata_value)
-        nodata_cloud = np.isin(mask_data, nodata_cloud_value) 
-        cld_free = data.where(~nodata_cloud).dropna(dim='time', how='all')
+        
+        # QA bands are unsigned integers, so flag cloud and nodata pixels
+        # in one pass by looking up each QA value in a boolean table
+        # instead of comparing every pixel against each QA value in turn
+        if mask_data.dtype.kind == 'u' and mask_data.dtype.itemsize <= 2:
+            nodata_cloud_lut = np.zeros(np.iinfo(mask_data.dtype).max + 1, 
+                                        dtype=bool)
+            nodata_cloud_lut[nodata_cloud_value] = True
+            nodata_cloud = nodata_cloud_lut[mask_data.values]
+        else:
+            nodata_cloud = np.isin(mask_data, nodata_cloud_value) 
+        clear = ~nodata_cloud
+    else:
+        clear = mask_data == 1
+    
+    # both sources share the same masking tail, so mask and drop empty 
+    # timesteps once here rather than separately in each branch
+    if all(isinstance(data[band].data, np.ndarray) and 
+           data[band].dims == mask_data.dims for band in data.data_vars):
+        # for data in memory, cast each band to (at least) float32 and 
+        # set cloud and nodata pixels to nan in place, instead of letting
+        # where() allocate a new float64 copy of every band
+        not_clear = ~np.asarray(clear)
+        cld_free = data.copy()
+        for band in data.data_vars:
+            band_dtype = np.promote_types(data[band].dtype, np.float32)
+            values = data[band].values.astype(band_dtype)
+            np.putmask(values, not_clear, np.nan)
+            cld_free[band] = data[band].copy(data=values)
     else:
-        cld_free = data.where(mask_data == 1).dropna(dim='time', how='all')
+        cld_free = data.where(clear)
+    cld_free = cld_free.dropna(dim='time', how='all')
            
     # remove nodata for the pixel of interest
     cld_free_valid = masking.mask_invalid_data(cld_free)
@@ -181,15 +209,15 @@ def get_common_dates_data(items_list):
         original_time_list.append(list(data_only.time.values))
         data_round_list.append(round_time_ns(data_only))
 
-    # find common dates
-    common_dates = set(data_round_list[0].time.values)
+    # find common dates (np.intersect1d returns these unique and sorted)
+    common_dates = data_round_list[0].time.values
     for a_data in data_round_list[1:]:
-        common_dates.intersection_update(set(a_data.time.values))
+        common_dates = np.intersect1d(common_dates, a_data.time.values)
     
     # find the data with common dates and convert back to original time
     i = 0
     for a_data in data_round_list:
-        data_common = a_data.sel(time=list(common_dates), method='nearest').sortby('time')
+        data_common = a_data.sel(time=common_dates, method='nearest')
         data_common = back2original_time_ns(data_common, original_time_list[i])       
         # replace the old data with the common_original_data
         items_list[i][list(items_list[i].keys())[0]]['data'] = data_common
@@ -286,6 +314,20 @@ def get_data_opensource(prod_info, input_lon, input_lat, acq_min, acq_max,
     return return_data 
     
     
+def get_shapefile_geometry(shapefile):
+    """
+    Read the first feature of a shapefile as a datacube Geometry. Only the
+    first record is parsed, and the file is closed before any data is 
+    loaded using the geometry.
+    """
+    
+    with fiona.open(shapefile) as shapes:
+        crs = geometry.CRS(shapes.crs_wkt)
+        first_geometry = next(iter(shapes))['geometry']
+        
+    return geometry.Geometry(first_geometry, crs=crs)
+    
+    
 # loading data by a shapefile
 def get_data_opensource_shapefile(prod_info, acq_min, acq_max, shapefile, 
                                   no_partial_scenes):
@@ -302,68 +344,65 @@ def get_data_opensource_shapefile(prod_info, acq_min, acq_max, shapefile,
     
     with warnings.catch_warnings():
         warnings.simplefilter("ignore")
-        with fiona.open(shapefile) as shapes:
-            crs = geometry.CRS(shapes.crs_wkt)
-            first_geometry = next(iter(shapes))['geometry']
-            geom = geometry.Geometry(first_geometry, crs=crs)            
+        geom = get_shapefile_geometry(shapefile)
 
-            return_data = {} 
-            data = xr.Dataset()
-            
-            if source_prod != '': 
-                # get a sample dataset to decide the target epsg
-                fd_query = {        
-                    'time': (acq_min, acq_max),
-                     'geopolygon': geom
-                    }
-                sample_fd_ds = remotedc.find_datasets(product=source_prod, 
-                                                      group_by='solar_day',
-                                                      **fd_query)
-
-                if (len(sample_fd_ds)) > 0:
-                    # decidce pixel size for output data
-                    pixel_x, pixel_y = get_pixel_size(sample_fd_ds[0], 
-                                                      source_band_list)
-                    log.info('Output pixel size for product {}: x={}, y={}'.format(source_prod, pixel_x, pixel_y))
-
-                    # get target epsg from metadata
-                    target_epsg = get_epsg(sample_fd_ds[0])
-                    log.info('CRS for product {}: {}'.format(source_prod, 
-                                                             target_epsg))
-                        
-                    query = {
-                            'time': (acq_min, acq_max),
-                            'geopolygon': geom,
-                            'output_crs' : target_epsg,
-                            'resolution': (-pixel_y, pixel_x),
-                            'measurements': source_band_list
-                            }
-
-                    if 's2' in source_prod:
-                        data = remotedc.load(product=source_prod, 
-                                             group_by='solar_day', **query)
-                    else:
-                        data = remotedc.load(product=source_prod, 
-                                             align=(pixel_x/2.0, pixel_y/2.0), 
-                                             group_by='solar_day', **query)
-                    
-                    # remove cloud and nodta    
-                    data = remove_cloud_nodata(source_prod, data, mask_band) 
-                    
-                    if data.data_vars: 
-                        mask = geometry_mask([geom], data.geobox, invert=True) 
-                        data = data.where(mask)
-
-                    if no_partial_scenes:
-                        # calculate valid data percentage
-                        data = only_return_whole_scene(data)                                             
-
-                return_data = {
-                               source_prod: {'data': data,
-                                             'mask_band': mask_band,
-                                             'find_list': sample_fd_ds }
-                              }
+        return_data = {} 
+        data = xr.Dataset()
+        
+        if source_prod != '': 
+            # get a sample dataset to decide the target epsg
+            fd_query = {        
+                'time': (acq_min, acq_max),
+                 'geopolygon': geom
+                }
+            sample_fd_ds = remotedc.find_datasets(product=source_prod, 
+                                                  group_by='solar_day',
+                                                  **fd_query)
+
+            if (len(sample_fd_ds)) > 0:
+                # decidce pixel size for output data
+                pixel_x, pixel_y = get_pixel_size(sample_fd_ds[0], 
+                                                  source_band_list)
+                log.info('Output pixel size for product {}: x={}, y={}'.format(source_prod, pixel_x, pixel_y))
+
+                # get target epsg from metadata
+                target_epsg = get_epsg(sample_fd_ds[0])
+                log.info('CRS for product {}: {}'.format(source_prod, 
+                                                         target_epsg))
                     
+                query = {
+                        'time': (acq_min, acq_max),
+                        'geopolygon': geom,
+                        'output_crs' : target_epsg,
+                        'resolution': (-pixel_y, pixel_x),
+                        'measurements': source_band_list
+                        }
+
+                if 's2' in source_prod:
+                    data = remotedc.load(product=source_prod, 
+                                         group_by='solar_day', **query)
+                else:
+                    data = remotedc.load(product=source_prod, 
+                                         align=(pixel_x/2.0, pixel_y/2.0), 
+                                         group_by='solar_day', **query)
+                
+                # remove cloud and nodta    
+                data = remove_cloud_nodata(source_prod, data, mask_band) 
+                
+                if len(data.data_vars) > 0: 
+                    mask = geometry_mask([geom], data.geobox, invert=True) 
+                    data = data.where(mask)
+
+                if no_partial_scenes:
+                    # calculate valid data percentage
+                    data = only_return_whole_scene(data)                                             
+
+            return_data = {
+                           source_prod: {'data': data,
+                                         'mask_band': mask_band,
+                                         'find_list': sample_fd_ds }
+                          }
+                
     return return_data 
 
 
@@ -390,7 +429,7 @@ def single_loc_process(prod_info, acq_min, acq_max, lon, lat, window_size,
     
     loaded_data = get_data_opensource(prod_info, lon, lat, acq_min, acq_max, 
                                       window_size, no_partial_scenes)        
-    if loaded_data[prod_info[1]]['data'].data_vars and len(loaded_data[prod_info[1]]['data'].time) > 0:
+    if len(loaded_data[prod_info[1]]['data'].data_vars) > 0 and len(loaded_data[prod_info[1]]['data'].time) > 0:
         return loaded_data
     else:
         print ('{}: No data available\r'.format(prod_info[1]))
@@ -416,7 +455,7 @@ def multiple_loc_process(prod_info, acq_min, acq_max, lon_lat_file,
                                               acq_max,  window_size, 
                                               no_partial_scenes) 
                         
-            if loaded_data[prod_info[1]]['data'].data_vars:            
+            if len(loaded_data[prod_info[1]]['data'].data_vars) > 0:            
                 if ((lon, lat), (acq_min, acq_max)) not in input_data_list:
                     input_data_list[((lon, lat), (acq_min, acq_max))] = []
                 input_data_list[((lon, lat), (acq_min, acq_max))].append(loaded_data)
@@ -432,7 +471,7 @@ def single_shape_process(prod_info, acq_min, acq_max, shapefile,
     loaded_data = get_data_opensource_shapefile(prod_info, acq_min, acq_max, 
                                                 shapefile, no_partial_scenes) 
 
-    if loaded_data[prod_info[1]]['data'].data_vars:
+    if len(loaded_data[prod_info[1]]['data'].data_vars) > 0:
         return loaded_data
     else:
         log.info('{}: No data available\r'.format(prod_info[1]))
@@ -455,7 +494,7 @@ def multi_shape_process(prod_info, acq_min, acq_max, multi_shape_file,
                                                         acq_max, a_shapefile, 
                                                         no_partial_scenes) 
             
-            if loaded_data[prod_info[1]]['data'].data_vars:
+            if len(loaded_data[prod_info[1]]['data'].data_vars) > 0:
                 if (a_shapefile, (acq_min, acq_max)) not in input_data_list:
                     input_data_list[(a_shapefile, (acq_min, acq_max))] = []
                 input_data_list[(a_shapefile, (acq_min, acq_max))].append(loaded_data)
@@ -580,6 +619,42 @@ def create_sub_folder(root, sub_folder):
     
     return output
 
+
+def values_per_time(band_info):
+    """
+    Return the values of a DataArray with a time dimension as a 2D numpy
+    array of shape (time, pixels), so statistics for every timestep can be 
+    calculated in one call by reducing along axis 1.
+    """
+    
+    other_dims = [dim for dim in band_info.dims if dim != 'time']
+    values = band_info.transpose('time', *other_dims).values
+    
+    return values.reshape(values.shape[0], -1)
+
+
+def get_stats_per_time(band_info):
+    """
+    Return the nan-aware mean, min, max, std, variance and valid pixel 
+    percentage of every timestep of a DataArray, each as a 1D array with 
+    one value per timestep.
+    """
+    
+    values = values_per_time(band_info)
+    
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")                
+        mean_sr = np.nanmean(values, axis=1)
+        min_sr = np.nanmin(values, axis=1)
+        max_sr = np.nanmax(values, axis=1)
+        std_sr = np.nanstd(values, axis=1)
+        variance_sr = np.nanvar(values, axis=1)
+        
+    valid_pixel_per = (np.count_nonzero(~np.isnan(values), axis=1) * 100 / 
+                       values.shape[1])
+    
+    return mean_sr, min_sr, max_sr, std_sr, variance_sr, valid_pixel_per
+    
     
 def produce_ga_output(sub_type, ard, ga_fd_ds, output_file, ga_fields):
        
@@ -594,84 +669,89 @@ def produce_ga_output(sub_type, ard, ga_fd_ds, output_file, ga_fields):
                              'swir1':'band_6', 'swir2':'band_7'}
               }
                     
-    with open(output_file, 'w') as csv_file:                                                                                
-        csv_writer = csv.writer(csv_file)
-        csv_writer.writerow(ga_fields) 
-        
-        for band in ard.data_vars:
-            if band.split('_')[0] == sub_type and 'contiguity' not in band:
-                band_info = ard[band]
+    # info from other bands is the same for every band of interest, so 
+    # calculate the mean of each timestep once up front
+    ancillary_bands = ['solar_azimuth', 'solar_zenith', 'azimuthal_exiting', 
+                       'azimuthal_incident', 'exiting', 'incident']
+    ancillary_mean = {anc_band: np.nanmean(values_per_time(ard[anc_band]), 
+                                           axis=1)
+                      for anc_band in ancillary_bands}
+    
+    # rows are buffered and written to the csv file in one go at the end
+    rows = []
+    
+    for band in ard.data_vars:
+        if band.split('_')[0] == sub_type and 'contiguity' not in band:
+            band_info = ard[band]
+            
+            # sr statistic info for all timesteps at once
+            sr_stats = get_stats_per_time(band_info)
+            
+            for i, a_time in enumerate(band_info.time.values):
+                date = str(a_time)[:19]
+                mean_sr, min_sr, max_sr, std_sr, variance_sr, \
+                    valid_pixel_per = [stat[i] for stat in sr_stats]
                 
-                for a_time in list(band_info.time.values):
-                    date = str(a_time)[:19]
-                    # sr statistic info
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")                
-                        mean_sr = np.nanmean(band_info.loc[a_time].values)
-                        min_sr = np.nanmin(band_info.loc[a_time].values)
-                        max_sr = np.nanmax(band_info.loc[a_time].values)
-                        std_sr = np.nanstd(band_info.loc[a_time].values)
-                        variance_sr = np.nanvar(band_info.loc[a_time].values)
-
-                    valid_pixel_per = np.count_nonzero(~np.isnan(band_info.loc[a_time].values)) * 100/ band_info.loc[a_time].values.size
-                    
-                    # info from other bands
-                    solar_azimuth = np.nanmean(ard.solar_azimuth.loc[a_time].values)
-                    solar_zenith = np.nanmean(ard.solar_zenith.loc[a_time].values)
-                    azimuthal_exiting = np.nanmean(ard.azimuthal_exiting.loc[a_time].values)
-                    azimuthal_incident = np.nanmean(ard.azimuthal_incident.loc[a_time].values)
-                    exiting = np.nanmean(ard.exiting.loc[a_time].values)
-                    incident = np.nanmean(ard.incident.loc[a_time].values)
-                    
-                    # info from metadata 
-                    sat = ''
-                    sensor = ''
-                    aerosol = ''
-                    brdf_geo = ''
-                    brdf_iso = ''
-                    brdf_vol = ''
-                    ozone = ''
-                    water_vapour = ''
-                    cloud_cover_per = ''
-                            
-                    for ds in ga_fd_ds:
-                        ds_time = '{}T{}'.format(str(ds.metadata_doc['extent']['center_dt'])[:10], 
-                                                 str(ds.metadata_doc['extent']['center_dt'])[11:26])
+                # info from other bands
+                solar_azimuth, solar_zenith, azimuthal_exiting, \
+                    azimuthal_incident, exiting, incident = \
+                    [ancillary_mean[anc_band][i] 
+                     for anc_band in ancillary_bands]
+                
+                # info from metadata 
+                sat = ''
+                sensor = ''
+                aerosol = ''
+                brdf_geo = ''
+                brdf_iso = ''
+                brdf_vol = ''
+                ozone = ''
+                water_vapour = ''
+                cloud_cover_per = ''
                         
-                        if ds_time[:16] in str(a_time):                
-                            sat = ds.metadata_doc['platform']['code']
-                            sensor = ds.metadata_doc['instrument']['name']
+                for ds in ga_fd_ds:
+                    ds_time = '{}T{}'.format(str(ds.metadata_doc['extent']['center_dt'])[:10], 
+                                             str(ds.metadata_doc['extent']['center_dt'])[11:26])
+                    
+                    if ds_time[:16] in str(a_time):                
+                        sat = ds.metadata_doc['platform']['code']
+                        sensor = ds.metadata_doc['instrument']['name']
 
-                            band_no_prefix = ''.join(band.split('_')[1:])
-                            if band_no_prefix == 'coastalaerosol':
-                                band_no_prefix = 'coastal_aerosol'
+                        band_no_prefix = ''.join(band.split('_')[1:])
+                        if band_no_prefix == 'coastalaerosol':
+                            band_no_prefix = 'coastal_aerosol'
 
-                            if band_no_prefix == 'coastal_aerosol' and sat != 'LANDSAT_8':
-                                continue
+                        if band_no_prefix == 'coastal_aerosol' and sat != 'LANDSAT_8':
+                            continue
   
-                            if 'aerosol' in ds.metadata_doc['lineage']['ancillary']:
-                                aerosol = ds.metadata_doc['lineage']['ancillary']['aerosol']['value']
-                            if 'brdf_geo_{}'.format(band_no[sat][band_no_prefix]) in ds.metadata_doc['lineage']['ancillary']:
-                                brdf_geo = ds.metadata_doc['lineage']['ancillary']['brdf_geo_{}'.format(band_no[sat][band_no_prefix])]['value']                           
-                            if 'brdf_iso_{}'.format(band_no[sat][band_no_prefix]) in ds.metadata_doc['lineage']['ancillary']:
-                                brdf_iso = ds.metadata_doc['lineage']['ancillary']['brdf_iso_{}'.format(band_no[sat][band_no_prefix])]['value']
-                            if 'brdf_vol_{}'.format(band_no[sat][band_no_prefix]) in ds.metadata_doc['lineage']['ancillary']:
-                                brdf_vol = ds.metadata_doc['lineage']['ancillary']['brdf_vol_{}'.format(band_no[sat][band_no_prefix])]['value']
-                            if 'ozone' in ds.metadata_doc['lineage']['ancillary']:
-                                ozone = ds.metadata_doc['lineage']['ancillary']['ozone']['value']
-                            if 'water_vapour' in ds.metadata_doc['lineage']['ancillary']:
-                                water_vapour = ds.metadata_doc['lineage']['ancillary']['water_vapour']['value']
-                            if 'other_metadata' in ds.metadata_doc['lineage']['source_datasets']:
-                                if 'IMAGE_ATTRIBUTES' in ds.metadata_doc['lineage']['source_datasets']['other_metadata']:
-                                    if 'cloud_cover_percentage' in ds.metadata_doc['lineage']['source_datasets']['other_metadata']['IMAGE_ATTRIBUTES']:
-                                        cloud_cover_per = ds.metadata_doc['lineage']['source_datasets']['other_metadata']['IMAGE_ATTRIBUTES']['CLOUD_COVER']                                   
-                          
-                            break                                
-                            
-                    csv_writer.writerow([band, date, sat, sensor, mean_sr, min_sr, max_sr, std_sr, variance_sr, 
-                                         valid_pixel_per, aerosol, brdf_geo, brdf_iso, brdf_vol, 
-                                         ozone, water_vapour, cloud_cover_per, solar_azimuth, solar_zenith,
-                                         azimuthal_exiting, azimuthal_incident, exiting, incident])
+                        if 'aerosol' in ds.metadata_doc['lineage']['ancillary']:
+                            aerosol = ds.metadata_doc['lineage']['ancillary']['aerosol']['value']
+                        if 'brdf_geo_{}'.format(band_no[sat][band_no_prefix]) in ds.metadata_doc['lineage']['ancillary']:
+                            brdf_geo = ds.metadata_doc['lineage']['ancillary']['brdf_geo_{}'.format(band_no[sat][band_no_prefix])]['value']                           
+                        if 'brdf_iso_{}'.format(band_no[sat][band_no_prefix]) in ds.metadata_doc['lineage']['ancillary']:
+                            brdf_iso = ds.metadata_doc['lineage']['ancillary']['brdf_iso_{}'.format(band_no[sat][band_no_prefix])]['value']
+                        if 'brdf_vol_{}'.format(band_no[sat][band_no_prefix]) in ds.metadata_doc['lineage']['ancillary']:
+                            brdf_vol = ds.metadata_doc['lineage']['ancillary']['brdf_vol_{}'.format(band_no[sat][band_no_prefix])]['value']
+                        if 'ozone' in ds.metadata_doc['lineage']['ancillary']:
+                            ozone = ds.metadata_doc['lineage']['ancillary']['ozone']['value']
+                        if 'water_vapour' in ds.metadata_doc['lineage']['ancillary']:
+                            water_vapour = ds.metadata_doc['lineage']['ancillary']['water_vapour']['value']
+                        if 'other_metadata' in ds.metadata_doc['lineage']['source_datasets']:
+                            if 'IMAGE_ATTRIBUTES' in ds.metadata_doc['lineage']['source_datasets']['other_metadata']:
+                                if 'cloud_cover_percentage' in ds.metadata_doc['lineage']['source_datasets']['other_metadata']['IMAGE_ATTRIBUTES']:
+                                    cloud_cover_per = ds.metadata_doc['lineage']['source_datasets']['other_metadata']['IMAGE_ATTRIBUTES']['CLOUD_COVER']                                   
+                      
+                        break                                
+                        
+                rows.append([band, date, sat, sensor, mean_sr, min_sr, max_sr, std_sr, variance_sr, 
+                             valid_pixel_per, aerosol, brdf_geo, brdf_iso, brdf_vol, 
+                             ozone, water_vapour, cloud_cover_per, solar_azimuth, solar_zenith,
+                             azimuthal_exiting, azimuthal_incident, exiting, incident])
+    
+    with open(output_file, 'w') as csv_file:                                                                                
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(ga_fields) 
+        csv_writer.writerows(rows)
                                  
                         
 def match_usgs_to_nbart_null(usgs_l2, match_ard):
@@ -695,50 +775,50 @@ def produce_usgs_output(usgs_l2, usgs_fd_ds, output_file, usgs_fields,
                         usgs_useless_bands):                 
     # usgs output
     band_interest = list(usgs_l2.data_vars)    
-                 
+    
+    # rows are buffered and written to the csv file in one go at the end
+    rows = []
+    
+    for band in band_interest:
+        if band not in usgs_useless_bands:
+            band_info = usgs_l2[band]
+            
+            # sr statistic info for all timesteps at once
+            sr_stats = get_stats_per_time(band_info)
+            
+            for i, time in enumerate(band_info.time.values):
+                date = str(time)[:19]
+                mean_sr, min_sr, max_sr, std_sr, variance_sr, \
+                    valid_pixel_per = [stat[i] for stat in sr_stats]
+
+                for ds in usgs_fd_ds:
+                    if str(ds.metadata_doc['extent']['center_dt'])[:16] in str(time):
+                        sat = ds.metadata_doc['platform']['code']
+                        sensor = ds.metadata_doc['instrument']['name']
+                        break
+                    
+                sr_atmos_opacity = ''
+                sr_aerosol = ''
+                if sat != 'LANDSAT_8':
+                    sr_atmos_opacity = np.nanmean(usgs_l2.sr_atmos_opacity.loc[time].values) * 0.001
+                else: 
+                    sr_aerosol = np.nanmean(usgs_l2.sr_aerosol.loc[time].values)
+                    if sr_aerosol in [66, 68, 72, 80, 96, 100]:
+                        sr_aerosol = 'Low-level aerosol'
+                    elif sr_aerosol in [130, 132, 136, 144, 160, 164]:    
+                        sr_aerosol = 'Medium-level aerosol'
+                    elif sr_aerosol in [194, 196, 200, 208, 224, 228]:
+                        sr_aerosol = 'High-level aerosol'
+            
+                rows.append([band, date, sat, sensor, mean_sr, min_sr, 
+                             max_sr, std_sr, variance_sr, 
+                             valid_pixel_per, 
+                             sr_atmos_opacity, sr_aerosol])       
+    
     with open(output_file, 'w') as csv_file: 
         csv_writer = csv.writer(csv_file) 
         csv_writer.writerow(usgs_fields)
-    
-        for band in band_interest:
-            if band not in usgs_useless_bands:
-                band_info = usgs_l2[band]
-                for time in list(band_info.time.values):
-                    date = str(time)[:19]
-    
-                    with warnings.catch_warnings():
-                        warnings.simplefilter("ignore")
-                        mean_sr = np.nanmean(band_info.loc[time].values)
-                        min_sr = np.nanmin(band_info.loc[time].values)
-                        max_sr = np.nanmax(band_info.loc[time].values)
-                        std_sr = np.nanstd(band_info.loc[time].values)
-                        variance_sr = np.nanvar(band_info.loc[time].values)
-    
-                    valid_pixel_per = np.count_nonzero(~np.isnan(band_info.loc[time].values)) * 100/ band_info.loc[time].values.size                
-    
-                    for ds in usgs_fd_ds:
-                        if str(ds.metadata_doc['extent']['center_dt'])[:16] in str(time):
-                            sat = ds.metadata_doc['platform']['code']
-                            sensor = ds.metadata_doc['instrument']['name']
-                            break
-                        
-                    sr_atmos_opacity = ''
-                    sr_aerosol = ''
-                    if sat != 'LANDSAT_8':
-                        sr_atmos_opacity = np.nanmean(usgs_l2.sr_atmos_opacity.loc[time].values) * 0.001
-                    else: 
-                        sr_aerosol = np.nanmean(usgs_l2.sr_aerosol.loc[time].values)
-                        if sr_aerosol in [66, 68, 72, 80, 96, 100]:
-                            sr_aerosol = 'Low-level aerosol'
-                        elif sr_aerosol in [130, 132, 136, 144, 160, 164]:    
-                            sr_aerosol = 'Medium-level aerosol'
-                        elif sr_aerosol in [194, 196, 200, 208, 224, 228]:
-                            sr_aerosol = 'High-level aerosol'
-                
-                    csv_writer.writerow([band, date, sat, sensor, mean_sr, min_sr, 
-                                         max_sr, std_sr, variance_sr, 
-                                         valid_pixel_per, 
-                                         sr_atmos_opacity, sr_aerosol])       
+        csv_writer.writerows(rows)
                                          
                                          
 def produce_reports(report_folder, loaded_products_list, common_dates):
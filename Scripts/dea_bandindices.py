@@ -14,6 +14,20 @@ Last modified: October 2019
 
 # Import required packages
 import warnings
+import numpy as np
+import xarray as xr
+
+
+# Tasseled cap coefficients (Crist 1985), built once at import time. 
+# Rows are ordered as the bands in `_TC_BANDS`, and columns as the 
+# indices in `_TC_INDICES`
+_TC_BANDS = ('blue', 'green', 'red', 'nir', 'swir1', 'swir2')
+_TC_INDICES = ('TCW', 'TCG', 'TCB')
+_TC_COEFFS = np.array([[0.0315, 0.2021, 0.3102, 0.1594, -0.6806, -0.6109],
+                       [-0.1603, -0.2819, -0.4934, 0.7940, -0.0002, -0.1446],
+                       [0.2043, 0.4158, 0.5524, 0.5741, 0.3124, -0.2303]],
+                      dtype=np.float32).T
+_TC_COEFFS.flags.writeable = False
 
 # Define custom functions
 def calculate_indices(ds,
@@ -95,6 +109,9 @@ def calculate_indices(ds,
     deep_copy: bool, optional
         If deep_copy=False, calculate_indices will modify the original
         array, adding bands to the input dataset and not removing them.
+        If deep_copy=True (the default), indices are added to a copy of 
+        the dataset instead. This copy shares the input band data rather
+        than duplicating it, so uses very little additional memory.
         If the calculate_indices function is run more than once, variables
         may be dropped incorrectly producing unexpected behaviour. This is
         a bug and may be fixed in future releases. This is only a problem 
@@ -112,15 +129,32 @@ def calculate_indices(ds,
     
     # Set ds equal to a copy of itself in order to prevent the function 
     # from editing the input dataset. This is to prevent unexpected 
-    # behaviour though it uses twice as much memory.    
+    # behaviour. As the function only ever adds new variables (and never
+    # modifies the data of existing ones), a shallow copy that shares 
+    # the underlying arrays is enough, and avoids copying every band
     if deep_copy:
-        ds = ds.copy(deep=True)
+        ds = ds.copy(deep=False)
     
     # Capture input band names in order to drop these if drop=True
     if drop:
         bands_to_drop=list(ds.data_vars)
         print(f'Dropping bands {bands_to_drop}')
 
+    # If index supplied is not a list, convert to list. This allows us to
+    # iterate through either multiple or single indices in the loop below
+    indices = index if isinstance(index, list) else [index]
+    
+    # Tasseled cap indices share the same six input bands, so all of the
+    # requested tasseled cap indices are calculated together the first
+    # time one of them is needed, and reused for the others
+    tc_arrays = {}
+    
+    def tasseled_cap(ds, tc_index):
+        if tc_index not in tc_arrays:
+            tc_indices = [i for i in _TC_INDICES if i in indices]
+            tc_arrays.update(_tasseled_cap(ds, tc_indices))
+        return tc_arrays[tc_index]
+
     # Dictionary containing remote sensing index band recipes
     index_dict = {
                   # Normalised Difference Vegation Index, Rouse 1973
@@ -213,19 +247,13 @@ def calculate_indices(ds,
                                     71 * ds.swir2),
 
                   # Tasseled Cap Wetness, Crist 1985
-                  'TCW': lambda ds: (0.0315 * ds.blue + 0.2021 * ds.green +
-                                     0.3102 * ds.red + 0.1594 * ds.nir +
-                                    -0.6806 * ds.swir1 + -0.6109 * ds.swir2),
+                  'TCW': lambda ds: tasseled_cap(ds, 'TCW'),
 
                   # Tasseled Cap Greeness, Crist 1985
-                  'TCG': lambda ds: (-0.1603 * ds.blue + -0.2819 * ds.green +
-                                     -0.4934 * ds.red + 0.7940 * ds.nir +
-                                     -0.0002 * ds.swir1 + -0.1446 * ds.swir2),
+                  'TCG': lambda ds: tasseled_cap(ds, 'TCG'),
 
                   # Tasseled Cap Brightness, Crist 1985
-                  'TCB': lambda ds: (0.2043 * ds.blue + 0.4158 * ds.green +
-                                     0.5524 * ds.red + 0.5741 * ds.nir +
-                                     0.3124 * ds.swir1 + -0.2303 * ds.swir2),
+                  'TCB': lambda ds: tasseled_cap(ds, 'TCB'),
 
                   # Clay Minerals Ratio, Drury 1987
                   'CMR': lambda ds: (ds.swir1 / ds.swir2),
@@ -237,10 +265,6 @@ def calculate_indices(ds,
                   'IOR': lambda ds: (ds.red / ds.blue)
     }
     
-    # If index supplied is not a list, convert to list. This allows us to
-    # iterate through either multiple or single indices in the loop below
-    indices = index if isinstance(index, list) else [index]
-    
     #calculate for each index in the list of indices supplied (indexes)
     for index in indices:
 
@@ -367,4 +391,82 @@ def calculate_indices(ds,
 
     # Return input dataset with added water index variable
     return ds
+
+
+def _tasseled_cap(ds, tc_indices, dtype=np.float32):
+    """
+    Calculates one or more tasseled cap indices (Crist 1985) from the 
+    'blue', 'green', 'red', 'nir', 'swir1' and 'swir2' bands of a 
+    dataset. For each chunk of data the bands are stacked once, and all 
+    of the requested indices are then computed in a single weighted sum
+    over the band axis rather than a separate pass over the data for 
+    each index.
+    
+    Parameters
+    ----------  
+    ds : xarray Dataset
+        A dataset containing the six bands listed above.
+    tc_indices : list of strs
+        The tasseled cap indices to calculate ('TCW', 'TCG' and/or 
+        'TCB').
+    dtype : numpy dtype, optional
+        The dtype used for the stacked bands, coefficients and output 
+        indices. Defaults to float32, which halves the memory moved
+        compared to float64 while remaining well within the precision 
+        of the input reflectance data.
+        
+    Returns
+    -------
+    tc_arrays : dict
+        A dictionary mapping each index name in `tc_indices` to an 
+        xarray DataArray containing the index values.
+    """
+    
+    # Select the coefficient matrix columns for the requested indices
+    columns = [_TC_INDICES.index(i) for i in tc_indices]
+    coeffs = _TC_COEFFS[:, columns].astype(dtype, copy=False)
+    
+    # Calculate all requested indices for each chunk of data in a single
+    # task (via `_tasseled_cap_block` below), instead of building 
+    # separate dask operations for every band and coefficient. Use 
+    # attribute access so missing bands raise the same AttributeError
+    # as the other indices
+    tc_stack = xr.apply_ufunc(_tasseled_cap_block,
+                              *[getattr(ds, band) for band in _TC_BANDS],
+                              kwargs={'coeffs': coeffs},
+                              output_core_dims=[['tc']],
+                              output_sizes={'tc': len(tc_indices)},
+                              output_dtypes=[coeffs.dtype],
+                              dask='parallelized')
+    
+    return {index: tc_stack.isel(tc=i) for i, index in enumerate(tc_indices)}
+
+
+def _tasseled_cap_block(*bands, coeffs):
+    """
+    Calculates tasseled cap indices for a block of data, by stacking the 
+    six input band arrays into a single array with a trailing band axis 
+    and multiplying this by a (band, index) coefficient matrix.
+    
+    Parameters
+    ----------  
+    *bands : numpy arrays
+        The 'blue', 'green', 'red', 'nir', 'swir1' and 'swir2' bands.
+    coeffs : numpy array
+        A coefficient matrix of shape (6, number of indices).
+        
+    Returns
+    -------
+    tc_block : numpy array
+        An array with the shape of the input bands plus a trailing axis
+        containing each index, with the same dtype as `coeffs`.
+    """
+    
+    # Write each band straight into a stacked array of the output dtype
+    shape = np.broadcast(*bands).shape
+    band_stack = np.empty(shape + (len(bands),), dtype=coeffs.dtype)
+    for i, band in enumerate(bands):
+        band_stack[..., i] = band
+    
+    return band_stack @ coeffs
   
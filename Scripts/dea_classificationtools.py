@@ -26,6 +26,8 @@ Authors: Richard Taylor, Sean Chua, Dan Clewley
 
 import numpy as np
 import xarray as xr
+import dask
+import dask.array
 import geopandas as gp
 import datacube
 from dask.diagnostics import ProgressBar
@@ -71,6 +73,17 @@ def sklearn_flatten(input_xr):
     """
     # cast input Datasets to DataArray
     if isinstance(input_xr, xr.Dataset):
+        
+        # where possible, copy each variable straight into its column
+        # of a (pixel, variable) array, rather than going through the 
+        # intermediate copies made by to_array, stack and transpose
+        stacked_np = _stack_pixels(input_xr)
+        if stacked_np is not None:
+            
+            # mask pixels with NaNs in *any* band, as below
+            mask = np.isnan(stacked_np).any(axis=1)
+            return stacked_np[~mask]
+        
         input_xr = input_xr.to_array()
 
     # stack across pixel dimensions, handling timeseries if necessary
@@ -176,6 +189,69 @@ def sklearn_unflatten(output_np, input_xr):
     return output_xr
 
 
+def _stack_pixels(input_ds):
+    """
+    Copy the variables of a Dataset into a single 2D array, with the 
+    'x', 'y' and (optionally) 'time' dimensions flattened along the 
+    first axis (in that order) and one column per variable. This matches
+    the layout of 
+    `input_ds.to_array().stack(z=[...]).transpose('z', 'variable')`, 
+    but each variable is copied only once, directly into its place in 
+    the output array. For dask-backed Datasets, the variables' dask 
+    arrays are stacked directly into a single lazy dask array.
+
+    Parameters
+    ----------
+    input_ds : xarray.Dataset
+        Must have dimensions 'x' and 'y', may have dimension 'time'.
+
+    Returns
+    ----------
+    stacked_np : numpy.array, dask.array or None
+        An array of shape (pixels, variables), or None if any variable 
+        has dimensions other than the pixel dimensions, or the 
+        variables are not all numpy arrays or all dask arrays with the 
+        same chunks (in which case the caller should fall back to 
+        `to_array`).
+
+    """
+
+    pixel_dims = ['x', 'y', 'time'] if 'time' in input_ds.dims else ['x', 'y']
+    data_vars = list(input_ds.data_vars)
+
+    if (len(data_vars) == 0) or any(
+            set(input_ds[var].dims) != set(pixel_dims)
+            for var in data_vars):
+        return None
+
+    arrays = [input_ds[var].transpose(*pixel_dims).data 
+              for var in data_vars]
+
+    # If the variables are dask arrays with identical chunks (e.g. as 
+    # loaded by `dc.load`), stack them straight into one dask array 
+    # with a trailing variable axis
+    if all(dask.is_dask_collection(array) for array in arrays):
+        if any(array.chunks != arrays[0].chunks for array in arrays):
+            return None
+        stacked = dask.array.stack(arrays, axis=-1)
+        return stacked.reshape(-1, len(data_vars))
+
+    if not all(isinstance(array, np.ndarray) for array in arrays):
+        return None
+
+    # Allocate the output with variables as the last (fastest changing) 
+    # axis, then write each variable into it. Assigning from the 
+    # transposed view copies the data once with no temporary array
+    shape = [input_ds.dims[dim] for dim in pixel_dims]
+    dtype = np.result_type(*[input_ds[var].dtype for var in data_vars])
+    stacked_np = np.empty(shape + [len(data_vars)], dtype=dtype)
+
+    for i, array in enumerate(arrays):
+        stacked_np[..., i] = array
+
+    return stacked_np.reshape(-1, len(data_vars))
+
+
 def fit_xr(model, input_xr):
     """
     Utilise our wrappers to fit a vanilla sklearn model.
@@ -290,7 +366,9 @@ def get_training_data_for_shp(path,
                               collection='ga_ls_2'):
     """
     Function to extract data for training classifier using a shapefile 
-    of labelled polygons. Currently works for single time steps.
+    of labelled polygons. Currently works for single time steps. When
+    `feature_stats='mean'`, pixels shared by overlapping polygons are 
+    only counted towards the polygon that comes last in the shapefile.
 
     Parameters
     ----------
@@ -337,8 +415,14 @@ def get_training_data_for_shp(path,
     dc = datacube.Datacube(app='training_data')
     query = {'time': time}
     query['crs'] = crs
+    
+    # Read all features once. If the shapefile has a CRS, reproject all
+    # features in a single vectorised call so the query extent is in `crs`
     shp = gp.read_file(path)
-    bounds = shp.total_bounds
+    if shp.crs:
+        bounds = shp.to_crs(crs=crs).total_bounds
+    else:
+        bounds = shp.total_bounds
     minx = bounds[0]
     maxx = bounds[2]
     miny = bounds[1]
@@ -371,52 +455,87 @@ def get_training_data_for_shp(path,
         pass
 
     print("Rasterizing features and extracting data...")
-    # Initialize counter for status messages.
-    i = 0
-    # Go through each feature
-    for poly_geom, poly_class_id in zip(shp.geometry, shp[field]):
-        print(" Feature {:04}/{:04}\r".format(i + 1, len(shp.geometry)), 
-              end='')
-
-        # Rasterise the feature
-        mask = rasterize([(poly_geom, poly_class_id)],
-                         out_shape=(data.y.size, data.x.size),
-                         transform=data.affine)
-
-        # Convert mask from numpy to DataArray
-        mask = xr.DataArray(mask, coords=(data.y, data.x))
-        # Mask out areas that were not within the labelled feature
-        data_masked = data.where(mask == poly_class_id, np.nan)
-
-        if feature_stats is None:
-            # If no summary stats were requested then
-            # extract all pixel values
-            flat_train = sklearn_flatten(data_masked)
-            # Make a labelled array of identical size
-            flat_val = np.repeat(poly_class_id, flat_train.shape[0])
-            stacked = np.hstack((np.expand_dims(flat_val, axis=1), flat_train))
-        elif feature_stats == 'mean':
-            # For the mean of each polygon take the mean over all
-            # axis, ignoring masked out values (nan).
-            # This gives a single pixel value for each band
-            flat_train = data_masked.mean(axis=None, skipna=True)
-            flat_train = flat_train.to_array()
-            stacked = np.hstack((poly_class_id, flat_train))
-        elif feature_stats == 'geomedian':
-            # For the geomedian flatten so have a 2D array with
-            # bands and pixel values. Then use hdstats
-            # to calculate the geomedian
-            flat_train = sklearn_flatten(data_masked)
-            flat_train_median = hdstats.geomedian(flat_train, axis=0)
-            # Geomedian will return a single value for each band so join
-            # this with class id to create a single row in output
-            stacked = np.hstack((poly_class_id, flat_train_median))
-
-        # Append training data and label to list
-        out.append(stacked)
-
-        # Update status counter (feature number)
-        i = i + 1
+    
+    # Reproject features to the CRS of the loaded data in one vectorised 
+    # call, so they line up with the data pixels when rasterised below
+    if shp.crs:
+        shp = shp.to_crs(crs=data.crs.wkt)
+    
+    if feature_stats == 'mean':
+        # Rasterise all features once into a single label image, where 
+        # each pixel holds the (1-based) position of the feature covering
+        # it in the shapefile. Where features overlap, pixels are 
+        # assigned to the feature that comes last
+        labels = rasterize([(poly_geom, i + 1) 
+                            for i, poly_geom in enumerate(shp.geometry)],
+                           out_shape=(data.y.size, data.x.size),
+                           transform=data.affine,
+                           dtype=np.uint32)
+
+        # For the mean of each polygon, sum the valid (non-nan) values 
+        # and count the valid pixels under each label for all features
+        # at once, ignoring masked out values (nan). This gives a single
+        # pixel value for each band
+        labels_flat = labels.ravel()
+        feature_means = []
+        for band in data.data_vars:
+            values = data[band].transpose('y', 'x').values.ravel()
+            valid = ~np.isnan(values)
+            sums = np.bincount(labels_flat[valid], weights=values[valid], 
+                               minlength=len(shp) + 1)
+            counts = np.bincount(labels_flat[valid], 
+                                 minlength=len(shp) + 1)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                feature_means.append(sums[1:] / counts[1:])
+        feature_means = np.column_stack(feature_means)
+
+        # Join the band means for each feature with its class id to 
+        # create a single row in output
+        for poly_class_id, flat_train in zip(shp[field], feature_means):
+            out.append(np.hstack((poly_class_id, flat_train)))
+
+    else:
+        # Initialize counter for status messages.
+        i = 0
+        # Go through each feature
+        for poly_geom, poly_class_id in zip(shp.geometry, shp[field]):
+            print(" Feature {:04}/{:04}\r".format(i + 1, len(shp.geometry)), 
+                  end='')
+
+            # Rasterise the feature on its own, so that pixels shared 
+            # with overlapping features are kept for every feature
+            mask = rasterize([(poly_geom, 1)],
+                             out_shape=(data.y.size, data.x.size),
+                             transform=data.affine,
+                             dtype=np.uint8)
+
+            # Convert mask from numpy to DataArray
+            mask = xr.DataArray(mask, coords=(data.y, data.x))
+            # Mask out areas that were not within the labelled feature
+            data_masked = data.where(mask == 1, np.nan)
+
+            if feature_stats is None:
+                # If no summary stats were requested then
+                # extract all pixel values
+                flat_train = sklearn_flatten(data_masked)
+                # Make a labelled array of identical size
+                flat_val = np.repeat(poly_class_id, flat_train.shape[0])
+                stacked = np.hstack((np.expand_dims(flat_val, axis=1), flat_train))
+            elif feature_stats == 'geomedian':
+                # For the geomedian flatten so have a 2D array with
+                # bands and pixel values. Then use hdstats
+                # to calculate the geomedian
+                flat_train = sklearn_flatten(data_masked)
+                flat_train_median = hdstats.geomedian(flat_train, axis=0)
+                # Geomedian will return a single value for each band so join
+                # this with class id to create a single row in output
+                stacked = np.hstack((poly_class_id, flat_train_median))
+
+            # Append training data and label to list
+            out.append(stacked)
+
+            # Update status counter (feature number)
+            i = i + 1
 
     # Return a list of labels for columns in output array
     return [field] + list(data.data_vars)
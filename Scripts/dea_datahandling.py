@@ -34,6 +34,8 @@ Last modified: February 2020
 # Import required packages
 import os
 import gdal
+import dask
+import dask.array
 import zipfile
 import numexpr
 import requests
@@ -41,9 +43,11 @@ import warnings
 import numpy as np
 import pandas as pd
 import xarray as xr
+import rasterio.features
 from copy import deepcopy
+from functools import lru_cache
+from contextlib import contextmanager
 from collections import Counter
-from datacube.storage import masking
 from scipy.ndimage import binary_dilation
 
 
@@ -91,7 +95,8 @@ def load_ard(dc,
         pixels required for a satellite observation to be loaded. 
         Defaults to 0.0 which will return all observations regardless of
         pixel quality (set to e.g. 0.99 to return only observations with
-        more than 99% good quality pixels).
+        more than 99% good quality pixels). If data is loaded using a
+        `geopolygon`, only pixels inside the polygon are counted.
     fmask_gooddata : list, optional
         An optional list of fmask values to treat as good quality 
         observations in the above `min_gooddata` calculation. The 
@@ -190,6 +195,56 @@ def load_ard(dc,
         
         except ValueError:        
             return da        
+        
+    def mask_attrs(da, mask=None, dtype=np.float32, 
+                   mask_invalid_data=True):
+        '''
+        Mask a data variable using the combined pixel quality/contiguity 
+        `mask` and, if `mask_invalid_data=True`, the variable's own 
+        'nodata' value, all in a single `.where()` pass. The variable is 
+        first converted to a custom dtype using `astype_attrs` above.
+        
+        Like `datacube.storage.masking.mask_invalid_data`, the 'nodata' 
+        attribute is dropped from variables where nodata values have 
+        been replaced with nans.
+        '''
+        
+        nodata = da.attrs.get('nodata')
+        mask_nodata = mask_invalid_data and (nodata is not None)
+        da_attrs = {key: value for key, value in da.attrs.items() 
+                    if not (mask_invalid_data and key == 'nodata')}
+        
+        # For numeric variables being cast to a dtype numexpr supports, 
+        # cast, compare to nodata, combine with `mask` and fill with 
+        # nans in one numexpr pass over each chunk of data. See 
+        # `_mask_numexpr` below
+        if (mask_nodata and 
+            np.issubdtype(da.dtype, np.number) and
+            np.dtype(dtype) in (np.float32, np.float64)):
+            
+            args = [da] if mask is None else [da, mask]
+            da = xr.apply_ufunc(_mask_numexpr, *args,
+                                kwargs={'nodata': nodata, 'dtype': dtype},
+                                dask='parallelized',
+                                output_dtypes=[dtype])
+            da.attrs = da_attrs
+            return da
+        
+        # Otherwise, combine the nodata mask with any other masks. The 
+        # comparison is done on the original (e.g. integer) data 
+        # before casting
+        if mask_nodata:
+            valid = da != nodata
+            mask = valid if mask is None else mask & valid
+        
+        da = astype_attrs(da, dtype=dtype)
+        
+        if mask is None:
+            return da
+        
+        da = da.where(mask)
+        da.attrs = da_attrs
+        return da
       
 
     # To prevent modifications to dcload_kwargs being made by this 
@@ -227,6 +282,10 @@ def load_ard(dc,
         raise ValueError("Loading both Sentinel-2 and Landsat data "
                          "at the same time is currently not supported")
 
+    # The fmask band is only required if it is used to filter or mask 
+    # observations. If it is not, skip loading and processing it 
+    use_fmask = (min_gooddata > 0.0) or mask_pixel_quality
+
     # If `measurements` are specified but do not include fmask or 
     # contiguity variables, add these to `measurements`
     to_drop = []  # store loaded var names here to later drop
@@ -234,7 +293,7 @@ def load_ard(dc,
     
     if 'measurements' in dcload_kwargs:        
 
-        if fmask_band not in dcload_kwargs['measurements']:
+        if use_fmask and (fmask_band not in dcload_kwargs['measurements']):
             dcload_kwargs['measurements'].append(fmask_band)
             to_drop.append(fmask_band)
 
@@ -251,7 +310,13 @@ def load_ard(dc,
         mask_contiguity = f'oa_{mask_contiguity}' if mask_contiguity else False
         fmask_band = f'oa_{fmask_band}' 
 
-    # Create a list to hold data for each product
+    # Boolean lookup table used to identify good quality fmask pixels
+    fmask_lut = _fmask_lut(tuple(fmask_gooddata))
+
+    # Create lists to hold lazily loaded data and good data percentages
+    # for each product, and the final filtered and masked data
+    product_lazy = []
+    data_perc_lazy = []
     product_data = []
 
     # Iterate through each requested product
@@ -288,90 +353,163 @@ def load_ard(dc,
                 print('    Ignoring SLC-off observations for ls7')
                 ds = ds.sel(time=ds.time < np.datetime64('2003-05-31'))
 
-            # Identify all pixels not affected by cloud/shadow/invalid
-            good_quality = ds[fmask_band].isin(fmask_gooddata)
+            # Identify all pixels not affected by cloud/shadow/invalid.
+            # As fmask is an 8-bit band, we can do this in a single pass
+            # by looking up each pixel in a 256 element boolean table,
+            # rather than comparing every pixel to each good data value
+            if not use_fmask:
+                good_quality = None
+            elif ds[fmask_band].dtype == np.uint8:
+                good_quality = xr.apply_ufunc(lambda fmask: fmask_lut[fmask],
+                                              ds[fmask_band],
+                                              dask='parallelized',
+                                              output_dtypes=[bool])
+            else:
+                good_quality = ds[fmask_band].isin(fmask_gooddata)
             
             # The good data percentage calculation has to load in all `fmask`
             # data, which can be slow. If the user has chosen no filtering 
             # by using the default `min_gooddata = 0`, we can skip this step 
             # completely to save processing time
+            data_perc = None
             if min_gooddata > 0.0:
 
-                # Compute good data for each observation as % of total pixels
-                data_perc = (good_quality.sum(axis=1).sum(axis=1) / 
-                    (good_quality.shape[1] * good_quality.shape[2]))
-
-                # Filter by `min_gooddata` to drop low quality observations
-                ds = ds.sel(time=data_perc >= min_gooddata)
-                print(f'    Filtering to {len(ds.time)} '
-                      f'out of {total_obs} observations')
-                
-            # If any data was returned
-            if len(ds.time) > 0:
-
-                # Optionally apply pixel quality mask to observations 
-                # remaining after the filtering step above to mask out 
-                # all remaining bad quality pixels
-                if mask_pixel_quality:
-                    print('    Applying pixel quality/cloud mask')
-
-                    # Change dtype to custom float before masking to 
-                    # save memory. See `astype_attrs` func docstring 
-                    # above for details  
-                    ds = ds.apply(astype_attrs, 
-                                  dtype=mask_dtype, 
-                                  keep_attrs=True)
-                    ds = ds.where(good_quality)
-                    
-                # Optionally filter to replace no data values with nans
-                if mask_invalid_data:
-                    print('    Applying invalid data mask')
-
-                    # Change dtype to custom float before masking to 
-                    # save memory. See `astype_attrs` func docstring 
-                    # above for details           
-                    ds = ds.apply(astype_attrs, 
-                                  dtype=mask_dtype, 
-                                  keep_attrs=True)
-                    ds = masking.mask_invalid_data(ds)
-
-                # Optionally apply contiguity mask to observations to
-                # remove pixels missing data in any band
-                if mask_contiguity:
-                    print('    Applying contiguity mask')
-
-                    # Change dtype to custom float before masking to 
-                    # save memory. See `astype_attrs` func docstring 
-                    # above for details   
-                    ds = ds.apply(astype_attrs, 
-                                  dtype=mask_dtype, 
-                                  keep_attrs=True)                    
-                    ds = ds.where(ds[mask_contiguity] == 1)   
-
-                # Optionally add satellite/product name as a new variable
-                if product_metadata:
-                    ds['product'] = xr.DataArray(
-                        [product] * len(ds.time), [('time', ds.time)])
-
-                # If any data was returned, add result to list
-                product_data.append(ds.drop(to_drop))
-                
-            # If no data is returned, print status
-            else:
-                print(f'    No data for {product}')
-                
+                # If data was loaded using a polygon, `dc.load` returns
+                # the polygon's bounding box. In this case, only count 
+                # pixels inside the polygon itself so that pixels outside
+                # the area of interest do not affect the calculation
+                if 'geopolygon' in dcload_kwargs:
+                    geopolygon = dcload_kwargs['geopolygon']
+                    roi_mask = rasterio.features.geometry_mask(
+                        [geopolygon.to_crs(ds.geobox.crs)],
+                        out_shape=ds.geobox.shape,
+                        transform=ds.geobox.affine,
+                        invert=True)
+
+                    # Polygons smaller than a pixel may not cover any 
+                    # pixel centres, which would give a total of zero 
+                    # pixels. In this case, fall back to the full extent
+                    total_pixels = roi_mask.sum()
+                    if total_pixels == 0:
+                        roi_mask = np.ones(ds.geobox.shape, dtype=bool)
+                        total_pixels = roi_mask.size
+                    good_quality_roi = good_quality.data & roi_mask
+                else:
+                    good_quality_roi = good_quality.data
+                    total_pixels = good_quality.shape[1] * good_quality.shape[2]
+
+                # Compute good data for each observation as % of total 
+                # pixels. Counting pixels with a single reduction over 
+                # both spatial axes of the underlying (time, y, x) array 
+                # avoids creating an intermediate xarray object per axis,
+                # and `count_nonzero` counts boolean values directly 
+                # without first converting them to integers to be summed
+                good_count = dask.array.count_nonzero(good_quality_roi, 
+                                                      axis=(1, 2))
+                data_perc = xr.DataArray(good_count / total_pixels,
+                                         coords=[ds.time], 
+                                         dims=['time'])
+
+            product_lazy.append((product, ds, good_quality, total_obs))
+            data_perc_lazy.append(data_perc)
 
         # If  AttributeError due to there being no variables in
         # the dataset, skip this product and move on to the next
         except AttributeError:
             print(f'    No data for {product}')
 
+    # Compute the good data percentages for all products together, so 
+    # that `fmask` data for every product is loaded in parallel within
+    # a single dask computation rather than one product after another.
+    # Only these small 1D arrays are computed here; all other bands 
+    # remain lazy until the final dataset is returned
+    if min_gooddata > 0.0 and product_lazy:
+        print('Calculating good data percentage for each observation')
+        data_percs = dask.compute(*data_perc_lazy)
+    else:
+        data_percs = data_perc_lazy
+
+    # Filter and mask data for each product
+    for (product, ds, good_quality, total_obs), data_perc in zip(
+            product_lazy, data_percs):
+
+        print(f'Preparing {product} data')
+
+        if data_perc is not None:
+
+            # Filter by `min_gooddata` to drop low quality observations.
+            # Selecting observations by integer position avoids any 
+            # label-based index lookup. The pixel quality mask is 
+            # subset in the same way so it still lines up with `ds`
+            keep_obs = np.flatnonzero((data_perc >= min_gooddata).values)
+            ds = ds.isel(time=keep_obs)
+            good_quality = good_quality.isel(time=keep_obs)
+            print(f'    Filtering to {len(ds.time)} '
+                  f'out of {total_obs} observations')
+
+        # If any data was returned
+        if len(ds.time) > 0:
+
+            # The pixel quality and contiguity masks below are combined 
+            # into a single mask, so that the data only needs to be 
+            # masked in one pass regardless of how many masks are used
+            mask = None
+
+            # Optionally apply pixel quality mask to observations 
+            # remaining after the filtering step above to mask out 
+            # all remaining bad quality pixels
+            if mask_pixel_quality:
+                print('    Applying pixel quality/cloud mask')
+                mask = good_quality
+
+            # Optionally apply contiguity mask to observations to
+            # remove pixels missing data in any band
+            if mask_contiguity:
+                print('    Applying contiguity mask')
+                contiguous = ds[mask_contiguity] == 1
+                mask = contiguous if mask is None else mask & contiguous
+
+            # Optionally filter to replace no data values with nans
+            if mask_invalid_data:
+                print('    Applying invalid data mask')
+
+            # Change dtype to custom float and apply all masks, including
+            # each variable's nodata mask, in a single pass over the data. 
+            # See `astype_attrs` and `mask_attrs` func docstrings above 
+            # for details. `keep_attrs` is not used here, as from xarray
+            # 0.16 it copies each input variable's attrs back onto the 
+            # output (undoing the 'nodata' drop in `mask_attrs`); the 
+            # dataset-level attrs are restored manually instead
+            if (mask is not None) or mask_invalid_data:
+                ds_attrs = ds.attrs
+                ds = ds.apply(mask_attrs, 
+                              mask=mask,
+                              dtype=mask_dtype, 
+                              mask_invalid_data=mask_invalid_data)
+                ds.attrs = ds_attrs
+
+            # Optionally add satellite/product name as a new variable
+            if product_metadata:
+                ds['product'] = xr.DataArray(
+                    [product] * len(ds.time), [('time', ds.time)])
+
+            # If any data was returned, add result to list
+            product_data.append(ds.drop(to_drop))
+
+        # If no data is returned, print status
+        else:
+            print(f'    No data for {product}')
+
     # If any data was returned above, combine into one xarray
     if (len(product_data) > 0):
 
-        # Concatenate results and sort by time
+        # Concatenate results and sort by time. As each product is 
+        # already sorted by time, a stable merge sort of the combined 
+        # times gives the order to take observations in directly
         print(f'Combining and sorting data')
-        combined_ds = xr.concat(product_data, dim='time').sortby('time')
+        all_times = np.concatenate([ds.time.values for ds in product_data])
+        time_order = np.argsort(all_times, kind='mergesort')
+        combined_ds = xr.concat(product_data, dim='time').isel(time=time_order)
         
         # If `lazy_load` is True, return data as a dask array without
         # actually loading it in
@@ -391,9 +529,10 @@ def load_ard(dc,
 
 
 def array_to_geotiff(fname, data, geo_transform, projection,
-                     nodata_val=0, dtype=gdal.GDT_Float32):
+                     nodata_val=0, dtype=gdal.GDT_Float32, 
+                     block_size=512, compress='ZSTD'):
     """
-    Create a single band GeoTIFF file with data from an array. 
+    Create a single or multi-band GeoTIFF file with data from an array. 
     
     Because this works with simple arrays rather than xarray datasets 
     from DEA, it requires geotransform info ("(upleft_x, x_size, 
@@ -416,7 +555,11 @@ def array_to_geotiff(fname, data, geo_transform, projection,
     fname : str
         Output geotiff file path including extension
     data : numpy array
-        Input array to export as a geotiff    
+        Input array to export as a geotiff. This can be either a 2D 
+        array of shape (rows, cols) which is written as a single band 
+        raster, or a 3D array of shape (bands, rows, cols) which is 
+        written as a multi-band raster (e.g. a stack of several 
+        variables from an xarray dataset)
     geo_transform : tuple 
         Geotransform for output raster; e.g. "(upleft_x, x_size, 
         x_rotation, upleft_y, y_rotation, y_size)"
@@ -428,25 +571,77 @@ def array_to_geotiff(fname, data, geo_transform, projection,
         Optionally set the dtype of the output raster; can be 
         useful when exporting an array of float or integer values. 
         Defaults to gdal.GDT_Float32
+    block_size : int, optional
+        The size in pixels of the square internal tiles used to store 
+        the output raster (must be a multiple of 16). Data is written 
+        one row of tiles at a time, so that only `block_size` rows of 
+        `data` need to be in memory at once (e.g. if `data` is a dask 
+        array). Defaults to 512.
+    compress : str, optional
+        The GDAL compression method used for the output raster, e.g. 
+        'ZSTD', 'DEFLATE' or 'LZW'. Tiles are compressed using all 
+        available CPUs, with a predictor suited to `dtype`. If GDAL 
+        was built without ZSTD support, 'DEFLATE' is used instead. Set 
+        to None to write an uncompressed raster. Defaults to 'ZSTD'.
         
     """
 
     # Set up driver
     driver = gdal.GetDriverByName('GTiff')
 
-    # Create raster of given size and projection
-    rows, cols = data.shape
-    dataset = driver.Create(fname, cols, rows, 1, dtype)
-    dataset.SetGeoTransform(geo_transform)
-    dataset.SetProjection(projection)
-
-    # Write data to array and set nodata values
-    band = dataset.GetRasterBand(1)
-    band.WriteArray(data)
-    band.SetNoDataValue(nodata_val)
-
-    # Close file
-    dataset = None
+    # Allow GDAL to use all available CPUs and a larger block cache 
+    # while the file is being written
+    with _gdal_write_config():
+
+        # Create a tiled raster of given size and projection
+        multiband = data.ndim == 3
+        bands, rows, cols = data.shape if multiband else (1, *data.shape)
+        options = ['TILED=YES',
+                   f'BLOCKXSIZE={block_size}',
+                   f'BLOCKYSIZE={block_size}',
+                   'BIGTIFF=IF_SAFER']
+        
+        # Optionally compress tiles using multiple threads, falling back
+        # to DEFLATE if this GDAL build does not support ZSTD
+        if compress is not None:
+            compress = compress.upper()
+            creation_options = driver.GetMetadataItem('DMD_CREATIONOPTIONLIST')
+            if compress == 'ZSTD' and 'ZSTD' not in creation_options:
+                compress = 'DEFLATE'
+            options += [f'COMPRESS={compress}', 'NUM_THREADS=ALL_CPUS']
+            if compress == 'ZSTD':
+                options.append('ZSTD_LEVEL=9')
+                
+            # Use the floating point predictor for float rasters and
+            # horizontal differencing for integer rasters, which both
+            # make tiles of smoothly varying values compress better
+            if compress in ('ZSTD', 'DEFLATE', 'LZW'):
+                is_float = dtype in (gdal.GDT_Float32, gdal.GDT_Float64)
+                options.append(f'PREDICTOR={3 if is_float else 2}')
+                
+        dataset = driver.Create(fname, cols, rows, bands, dtype, 
+                                options=options)
+        dataset.SetGeoTransform(geo_transform)
+        dataset.SetProjection(projection)
+
+        # Write data to array one row of tiles at a time. Slicing before 
+        # converting to numpy means that lazy arrays are only computed 
+        # for the rows being written. For multi-band arrays, each row of
+        # tiles is read once for all bands, then written band by band
+        # (which unlike `Dataset.WriteArray` works on any GDAL version)
+        for row in range(0, rows, block_size):
+            block = np.asarray(data[..., row:row + block_size, :])
+            if not multiband:
+                block = block[np.newaxis]
+            for i in range(bands):
+                dataset.GetRasterBand(i + 1).WriteArray(block[i], 0, row)
+
+        # Set nodata values
+        for i in range(1, bands + 1):
+            dataset.GetRasterBand(i).SetNoDataValue(nodata_val)
+
+        # Close file
+        dataset = None
 
 
 def mostcommon_crs(dc, product, query):    
@@ -666,3 +861,103 @@ def paths_to_datetimeindex(paths, string_slice=(0, 10)):
     date_strings = [os.path.basename(i)[slice(*string_slice)] 
                     for i in paths]
     return pd.to_datetime(date_strings)
+
+
+@lru_cache(maxsize=16)
+def _fmask_lut(fmask_gooddata):
+    '''
+    Creates a read-only 256 element boolean lookup table that is True 
+    for each value in `fmask_gooddata`, for use by `load_ard`. Results 
+    are cached, as the same good data values are typically used for 
+    every call (e.g. the default `(1, 4, 5)`).
+    
+    Parameters
+    ----------     
+    fmask_gooddata : tuple
+        A tuple of fmask values to treat as good quality observations.
+        
+    Returns
+    -------
+    A numpy array of 256 booleans, indexed by fmask value.
+    '''
+    
+    fmask_lut = np.zeros(256, dtype=bool)
+    fmask_lut[list(fmask_gooddata)] = True
+    fmask_lut.setflags(write=False)
+    
+    return fmask_lut
+
+
+def _mask_numexpr(data, mask=None, nodata=None, dtype=np.float32):
+    '''
+    Casts a numpy array to `dtype`, then sets any pixels that are equal
+    to `nodata` or are False in the boolean array `mask` to nan. The 
+    comparison, mask and fill are evaluated by numexpr in a single 
+    multithreaded pass, written in place over the cast copy of the data.
+    Used by `load_ard` (via `xr.apply_ufunc`) to mask each chunk of data.
+    
+    Parameters
+    ----------
+    data : numpy array
+        The array to mask.
+    mask : numpy array, optional
+        A boolean array that broadcasts against `data`, where True 
+        indicates pixels to keep. Defaults to None, which only masks
+        `nodata` pixels.
+    nodata : int or float
+        The nodata value of `data`.
+    dtype : numpy dtype, optional
+        The float dtype of the output array (np.float32 or np.float64).
+        Defaults to np.float32.
+        
+    Returns
+    -------
+    out : numpy array
+        The masked array, cast to `dtype`.
+    '''
+    
+    # Constants are passed as scalars of the output dtype, so numexpr 
+    # does not promote float32 data to float64 while evaluating
+    out = data.astype(dtype)
+    local_dict = {'out': out,
+                  'nodata': np.dtype(dtype).type(nodata),
+                  'nan': np.dtype(dtype).type(np.nan)}
+    
+    if mask is None:
+        exp = 'where(out != nodata, out, nan)'
+    else:
+        exp = 'where(mask & (out != nodata), out, nan)'
+        local_dict['mask'] = mask
+    
+    return numexpr.evaluate(exp, local_dict=local_dict, out=out)
+
+
+@contextmanager
+def _gdal_write_config(num_threads='ALL_CPUS', cache_max=1024):
+    '''
+    Context manager that temporarily sets GDAL to use multiple threads 
+    (e.g. for compressing GeoTIFF blocks) and a larger raster block 
+    cache, for use by `array_to_geotiff`. The previous GDAL settings 
+    are restored on exit.
+    
+    Parameters
+    ----------     
+    num_threads : str or int, optional
+        Value for the `GDAL_NUM_THREADS` config option. Defaults to 
+        'ALL_CPUS'.
+    cache_max : int, optional
+        The minimum size of the GDAL block cache in megabytes (a larger 
+        existing cache is left unchanged). Defaults to 1024.
+    '''
+    
+    previous_threads = gdal.GetConfigOption('GDAL_NUM_THREADS')
+    previous_cache = gdal.GetCacheMax()
+    
+    gdal.SetConfigOption('GDAL_NUM_THREADS', str(num_threads))
+    gdal.SetCacheMax(max(previous_cache, cache_max * 1024 * 1024))
+    
+    try:
+        yield
+    finally:
+        gdal.SetConfigOption('GDAL_NUM_THREADS', previous_threads)
+        gdal.SetCacheMax(previous_cache)
@@ -96,7 +96,7 @@ def xr_vectorize(da,
     # Check for a crs object
     try:
         crs = da.crs
-    except:
+    except AttributeError:
         if crs is None:
             raise Exception("Please add a `crs` attribute to the "
                             "xarray.DataArray, or provide a CRS using the "
@@ -109,11 +109,11 @@ def xr_vectorize(da,
             # First, try to take transform info from geobox
             transform = da.geobox.transform
         # If no geobox
-        except:
+        except AttributeError:
             try:
                 # Try getting transform from 'transform' attribute
                 transform = da.transform
-            except:
+            except AttributeError:
                 # If neither of those options work, raise an exception telling the 
                 # user to provide a transform
                 raise Exception("Please provide an Affine transform object using the "
@@ -219,10 +219,10 @@ def xr_rasterize(gdf,
     # Check for a crs object
     try:
         crs = da.geobox.crs
-    except:
+    except AttributeError:
         try:
             crs = da.crs
-        except:
+        except AttributeError:
             if crs is None:
                 raise Exception("Please add a `crs` attribute to the "
                             "xarray.DataArray, or provide a CRS using the "
@@ -235,11 +235,11 @@ def xr_rasterize(gdf,
             # First, try to take transform info from geobox
             transform = da.geobox.transform
         # If no geobox
-        except:
+        except AttributeError:
             try:
                 # Try getting transform from 'transform' attribute
                 transform = da.transform
-            except:
+            except AttributeError:
                 # If neither of those options work, raise an exception telling the 
                 # user to provide a transform
                 raise Exception("Please provide an Affine transform object using the "
@@ -250,7 +250,7 @@ def xr_rasterize(gdf,
     # Grab the 2D dims (not time)    
     try:
         dims = da.geobox.dims
-    except:
+    except AttributeError:
         dims = y_dim, x_dim  
     
     # Coords
@@ -259,7 +259,7 @@ def xr_rasterize(gdf,
     # Shape
     try:
         y, x = da.geobox.shape
-    except:
+    except AttributeError:
         y, x = len(xy_coords[0]), len(xy_coords[1])
     
     # Reproject shapefile to match CRS of raster
@@ -268,7 +268,7 @@ def xr_rasterize(gdf,
     
     try:
         gdf_reproj = gdf.to_crs(crs=crs)
-    except:
+    except Exception:
         # Sometimes the crs can be a datacube utils CRS object
         # so convert to string before reprojecting
         gdf_reproj = gdf.to_crs(crs={'init': str(crs)})
@@ -413,7 +413,7 @@ def subpixel_contours(da,
     # If not, require supplied CRS
     try:
         crs = da.crs
-    except:
+    except AttributeError:
         if crs is None:
             raise Exception("Please add a `crs` attribute to the "
                             "xarray.DataArray, or provide a CRS using the "
@@ -425,7 +425,7 @@ def subpixel_contours(da,
         affine = da.geobox.transform
     except KeyError:
         affine = da.transform
-    except:
+    except AttributeError:
         if affine is None:
             raise Exception("Please provide an Affine object using the "
                             "`affine` parameter (e.g. `from affine import "
@@ -660,7 +660,7 @@ def contours_to_arrays(gdf, col):
         try:
             coords = np.concatenate([np.vstack(x.coords.xy).T 
                                      for x in gdf.iloc[i].geometry])
-        except:
+        except TypeError:
             coords = np.vstack(gdf.iloc[i].geometry.coords.xy).T
 
         coords_zvals.append(np.column_stack((coords, 
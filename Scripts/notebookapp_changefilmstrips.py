@@ -18,6 +18,7 @@ import numpy as np
 import pandas as pd
 import xarray as xr
 import matplotlib.pyplot as plt
+from functools import partial
 from odc.algo import xr_geomedian 
 from odc.ui import select_on_a_map
 from dask.utils import parse_bytes
@@ -197,14 +198,35 @@ def run_filmstrip_app(output_name,
                       .fillna(labels[-1])) 
         time_steps_var = xr.DataArray(time_steps, [('time', ds.time)], 
                                       name='timestep')
+        
+        # Each geomedian task needs every observation in a time step for
+        # all bands at once. Split the loaded spatial chunks into smaller
+        # square tiles so that a single task for the largest time step
+        # stays within ~256 MB, instead of holding a full 2000 x 2000
+        # pixel chunk for every observation. To keep this a simple split
+        # with no data shuffling, the tile size is the largest divisor of
+        # the chunk size used when loading that fits this budget (or the 
+        # smallest divisor of at least 256 pixels if none fit)
+        load_chunk = query['dask_chunks']['x']
+        max_obs = time_steps.value_counts().max()
+        itemsize = max(ds[band].dtype.itemsize for band in ds.data_vars)
+        tile_budget = np.sqrt(parse_bytes('256MB') / 
+                              (len(ds.data_vars) * max_obs * itemsize))
+        divisors = [size for size in range(min(256, load_chunk), 
+                                           load_chunk + 1)
+                    if load_chunk % size == 0]
+        fit_budget = [size for size in divisors if size <= tile_budget]
+        tile = max(fit_budget) if fit_budget else min(divisors)
+        ds = ds.chunk({'x': tile, 'y': tile})
 
         # Resample data temporally into time steps, and compute geomedians
-        ds_geomedian = (ds.groupby(time_steps_var)
-                        .apply(lambda ds_subset: 
-                               xr_geomedian(ds_subset, 
-                                  num_threads=1,  # disable internal threading, dask will run several concurrently
-                                  eps=0.2 * (1 / 10_000),  # 1/5 pixel value resolution
-                                  nocheck=True)))  # disable some checks inside geomedian library that use too much ram
+        # Geomedian function with its settings bound, applied to each 
+        # time step below
+        geomedian_func = partial(xr_geomedian,
+                                 num_threads=1,  # disable internal threading, dask will run several concurrently
+                                 eps=0.2 * (1 / 10_000),  # 1/5 pixel value resolution
+                                 nocheck=True)  # disable some checks inside geomedian library that use too much ram
+        ds_geomedian = ds.groupby(time_steps_var).apply(geomedian_func)
 
         print('\nGenerating geomedian composites and plotting '
               'filmstrips... (click the Dashboard link above for status)')
@@ -82,6 +82,10 @@ def load_miningrehab_data():
 
     # Resample
     ds_resampled = ds_fc_masked.resample(time="1M").median()
+
+    # Reattach only the dataset CRS. The variable attributes dropped above
+    # (e.g. 'percent' units and the nodata value) no longer apply to the
+    # scaled proportions, so these are deliberately not kept
     ds_resampled.attrs["crs"] = dataset_fc.crs
 
     # Return the data
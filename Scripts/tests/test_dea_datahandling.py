@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for functions in dea_datahandling.py
+"""
+
+import unittest
+import sys
+import xarray as xr
+import numpy as np
+import os.path
+from inspect import getfile, currentframe
+
+
+class FakeDatacube(object):
+    """
+    Minimal stand-in for `datacube.Datacube` that returns a subset of a
+    fixed dataset from `load`, lazily loaded as dask arrays if
+    `dask_chunks` is given.
+    """
+
+    def __init__(self, ds):
+        self.ds = ds
+
+    def load(self, product, measurements, dask_chunks=None, **kwargs):
+        ds = self.ds[measurements]
+        return ds if dask_chunks is None else ds.chunk({'time': 1})
+
+
+class DataHandlingTest(unittest.TestCase):
+
+    def setUp(self):
+
+        cmd_folder = os.path.realpath(os.path.abspath(
+                                      os.path.split(getfile(
+                                                    currentframe()))[0]))
+
+        parent = os.path.abspath(os.path.join(cmd_folder, os.pardir))
+
+        if parent not in sys.path:
+            sys.path.insert(0, parent)
+
+
+    def test_load_ard_filter_then_mask(self):
+
+        from dea_datahandling import load_ard
+
+        times = np.array(['2018-02-10', '2018-02-26', '2018-03-14'],
+                         dtype='datetime64[ns]')
+
+        red_data = xr.DataArray(np.array([[[ 580, -999],
+                                           [ 627,  691]],
+
+                                          [[ 597,  615],
+                                           [ 562,  615]],
+
+                                          [[ 601,  669],
+                                           [ 534,  646]]], dtype=np.int16),
+                                coords={'time': times},
+                                dims=('time', 'y', 'x'),
+                                attrs={'nodata': -999})
+
+        # The second observation is entirely cloud (fmask = 2), and the
+        # third has one cloudy pixel
+        fmask_data = xr.DataArray(np.array([[[1, 1],
+                                             [1, 1]],
+
+                                            [[2, 2],
+                                             [2, 2]],
+
+                                            [[1, 2],
+                                             [1, 1]]], dtype=np.uint8),
+                                  coords={'time': times},
+                                  dims=('time', 'y', 'x'),
+                                  attrs={'nodata': 0})
+
+        dc = FakeDatacube(xr.Dataset({'nbart_red': red_data,
+                                      'fmask': fmask_data}))
+
+        out_data = load_ard(dc,
+                            products=['ga_ls8c_ard_3'],
+                            measurements=['nbart_red'],
+                            min_gooddata=0.5)
+
+        expected_red = np.array([[[ 580., np.nan],
+                                  [ 627.,  691.]],
+
+                                 [[ 601., np.nan],
+                                  [ 534.,  646.]]], dtype=np.float32)
+
+        self.assertEqual(list(out_data.time.values), [times[0], times[2]])
+        self.assertEqual(list(out_data.data_vars), ['nbart_red'])
+        self.assertEqual(out_data.nbart_red.dtype, np.float32)
+        self.assertNotIn('nodata', out_data.nbart_red.attrs)
+        np.testing.assert_array_equal(out_data.nbart_red.values,
+                                      expected_red)
+
+
+if __name__ == '__main__':
+    unittest.main()